@@ -1,14 +1,57 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 import tkinter as tk
 from PIL import Image, ImageTk
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import PolygonSelector
 import cv2
-import imageio
 
-def download_images(topic_id, root_id, no_images):
+# Shared session so repeated calls to the SpotterON API and file server reuse keep-alive connections
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=50,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
+
+def _download_image(session, img, folder_path):
+    """
+    Downloads a single SpotterON image and streams it to folder_path.
+
+    Args:
+        session (requests.Session): Session used for the HTTP request.
+        img (str): The image path returned by the SpotterON API, e.g. '2024/06/01/abc'.
+        folder_path (str): Directory the image is saved to.
+
+    Raises:
+        requests.HTTPError: If the image request fails.
+        requests.RequestException: If the connection drops mid-transfer; no partial file is left behind.
+    """
+    img_url = f"https://files.spotteron.com/images/spots/{img}.jpg"
+    split_img = img.split("/")
+    img = "-".join(split_img)
+    img_filename = os.path.join(folder_path, f"{img}.jpg")
+
+    # Stream the body to disk rather than holding the whole JPEG in memory. It goes to a .part file that is
+    # only renamed once complete, so a dropped connection never leaves a truncated JPEG in folder_path
+    part_filename = img_filename + '.part'
+    try:
+        with session.get(img_url, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(part_filename, 'wb') as img_file:
+                shutil.copyfileobj(response.raw, img_file, length=1 << 16)
+        os.replace(part_filename, img_filename)
+    except BaseException:
+        if os.path.exists(part_filename):
+            os.remove(part_filename)
+        raise
+
+def download_images(topic_id, root_id, no_images, session=_session, max_workers=8):
     """
     Downloads a specified number of images from the SpotterON platform based on topic and root identifiers.
 
@@ -16,6 +59,9 @@ def download_images(topic_id, root_id, no_images):
         topic_id (int or str): The identifier for the topic category from which to download images.
         root_id (int or str): The identifier for the root category within the topic from which to download images.
         no_images (int): The number of images to download. If set to -1, downloads all available images.
+        session (requests.Session, optional): Session used for all HTTP requests. Defaults to a module-level
+            session with a pooled, retrying adapter so TCP/TLS connections are reused between requests.
+        max_workers (int, optional): Number of images downloaded concurrently. Defaults to 8.
 
     Returns:
         None: This function does not return any value but downloads images to a specified directory.
@@ -36,7 +82,7 @@ def download_images(topic_id, root_id, no_images):
     page = 1
     params = f'filter[topic_id]={topic_id}&filter[root_id]={root_id}&limit=10&page={page}&order[]=id+desc'
     url = f'{endpoint}?{params}'
-    response = requests.get(url)
+    response = session.get(url)
 
     if response.status_code == 200:
         data = response.json()
@@ -45,36 +91,42 @@ def download_images(topic_id, root_id, no_images):
         img_count = 0
         folder_path = 'raw'
         os.makedirs(folder_path, exist_ok=True)
-        
-        for page in range(1, page_count+1):
-            params = f'filter[topic_id]={topic_id}&filter[root_id]={root_id}&limit=10&page={page}&order[]=id+desc'
-            url = f'{endpoint}?{params}'
-            response = requests.get(url)
-
-            if response.status_code == 200:
-                data = response.json()
-                spots = data.get("data", [])
-
-                for spot in spots:
-                    img_count += 1
-
-                    if img_count > no_images and no_images != -1:
-                        return
-
-                    img = spot.get('attributes', {}).get('image')
-                    if img:
-                        img_url = f"https://files.spotteron.com/images/spots/{img}.jpg"
-                        img_data = requests.get(img_url).content
-                        split_img = img.split("/")
-                        img = "-".join(split_img)
-                        img_filename = os.path.join(folder_path, f"{img}.jpg")
-
-                        with open(img_filename, 'wb') as img_file:
-                            img_file.write(img_data)
-
-            else:
-                print(f"Error: {response.status_code} - {response.text}")
-                break
+        images = []
+
+        # The API serves 10 spots per page, so only request the pages needed to reach no_images;
+        # page 1 was already fetched for the metadata and is reused
+        last_page = page_count if no_images == -1 else min(page_count, -(-no_images // 10))
+        page_urls = [f'{endpoint}?filter[topic_id]={topic_id}&filter[root_id]={root_id}&limit=10&page={page}&order[]=id+desc'
+                     for page in range(2, last_page+1)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Page requests are independent, so fetch them concurrently; map yields them in page order
+            for response in chain([response], executor.map(session.get, page_urls)):
+                if img_count == no_images:
+                    break
+
+                if response.status_code == 200:
+                    data = response.json()
+                    spots = data.get("data", [])
+
+                    for spot in spots:
+                        if img_count == no_images:
+                            break
+                        img_count += 1
+
+                        img = spot.get('attributes', {}).get('image')
+                        if img:
+                            images.append(img)
+
+                else:
+                    print(f"Error: {response.status_code} - {response.text}")
+                    break
+
+            # Image downloads are network-bound, so fetch them concurrently over the pooled session;
+            # results are collected as they finish so a slow transfer does not hold up error reporting
+            futures = [executor.submit(_download_image, session, img, folder_path) for img in images]
+            for future in as_completed(futures):
+                future.result()
 
     else:
         print(f"Error: {response.status_code} - {response.text}")
@@ -98,7 +150,8 @@ def select_control_image(directory):
     root = tk.Tk()
     root.title("Select Control Image")
     
-    images = [img for img in os.listdir(directory) if img.endswith('.jpg')]
+    with os.scandir(directory) as entries:
+        images = [entry.name for entry in entries if entry.name.endswith('.jpg') and entry.is_file()]
     if not images:
         print("No images found in the directory.")
         return None
@@ -107,15 +160,43 @@ def select_control_image(directory):
     # Current image index
     current_image_index = [0]
 
+    # Recently shown thumbnails, least recently used first, so going back does not decode again
+    photos = OrderedDict()
+    # Thumbnails of the neighbouring images being decoded in the background
+    prefetched = {}
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    def decode_thumbnail(index):
+        img_path = os.path.join(directory, images[index])
+        with Image.open(img_path) as img:
+            img.draft('RGB', (800, 800))  # Let libjpeg downscale during decode
+            img.thumbnail((800, 800))
+            return img
+
     # Load the first image
     def load_image(index):
-        img_path = os.path.join(directory, images[index])
-        img = Image.open(img_path)
-        img.thumbnail((800, 800))
-        photo = ImageTk.PhotoImage(img)
+        if index in photos:
+            photos.move_to_end(index)
+            return photos[index]
+        future = prefetched.pop(index, None)
+        img = future.result() if future is not None else decode_thumbnail(index)
+        photo = ImageTk.PhotoImage(img)  # Tk objects are only created on the main thread
+        photos[index] = photo
+        if len(photos) > 16:
+            photos.popitem(last=False)
         return photo
 
+    # Start decoding the previous and next images while the user looks at the current one
+    def prefetch(index):
+        for i in list(prefetched):
+            if abs(i - index) > 3:
+                prefetched.pop(i).cancel()
+        for i in (index + 1, index - 1):
+            if 0 <= i < len(images) and i not in photos and i not in prefetched:
+                prefetched[i] = executor.submit(decode_thumbnail, i)
+
     photo = load_image(current_image_index[0])
+    prefetch(current_image_index[0])
 
     image_label = tk.Label(root, image=photo)
     image_label.image = photo
@@ -128,6 +209,7 @@ def select_control_image(directory):
         new_photo = load_image(current_image_index[0])
         image_label.configure(image=new_photo)
         image_label.image = new_photo
+        prefetch(current_image_index[0])
 
     # Navigation buttons
     btn_prev = tk.Button(root, text="<< Previous", command=lambda: update_image(-1))
@@ -146,6 +228,7 @@ def select_control_image(directory):
 
     root.selected_image = None
     root.mainloop()
+    executor.shutdown(wait=False, cancel_futures=True)
     return root.selected_image
 
 def generate_mask(image_path):
@@ -162,7 +245,8 @@ def generate_mask(image_path):
 
     Returns:
         ndarray or None: A binary mask of the same dimensions as the input image if polygons are drawn; otherwise, None.
-        The function also saves the polygon vertices to 'polygon_coordinates.npy' if any polygons are drawn.
+        The function also saves the polygon vertices to 'polygon_coordinates.npz' if any polygons are drawn, as an
+        int32 'verts' array with polygon i at verts[offsets[i]:offsets[i+1]].
 
     Raises:
         FileNotFoundError: If the specified image_path does not point to a valid file.
@@ -171,7 +255,18 @@ def generate_mask(image_path):
         mask = generate_mask('raw/image.jpg')
     """
     polygons = []
-    image = imageio.imread(image_path)
+    with Image.open(image_path) as img:
+        width, height = img.size
+
+    # Only a 15x12 inch figure is shown, so let libjpeg decode at the largest reduction that still fills it;
+    # polygon vertices are mapped back to full resolution afterwards
+    scale, flag = 1, cv2.IMREAD_COLOR
+    for s, f in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) // s >= 1500:
+            scale, flag = s, f
+            break
+    # PIL's size ignores EXIF orientation, so the decode must too or the polygons land in a rotated frame
+    image = cv2.imread(image_path, flag | cv2.IMREAD_IGNORE_ORIENTATION)[..., ::-1]
 
     # Function to create a window, draw a polygon and return its vertices
     def create_window_and_draw_polygon():
@@ -189,7 +284,8 @@ def generate_mask(image_path):
         print("Draw a polygon and finalize it by completing the shape.")
         verts = create_window_and_draw_polygon()
         if verts:
-            polygons.append(np.array(verts))
+            # Centre of a reduced pixel in full resolution pixel coordinates
+            polygons.append(np.array(verts) * scale + (scale - 1) / 2)
             print("Polygon saved. Number of vertices:", len(verts))
         else:
             print("No valid polygon drawn.")
@@ -201,12 +297,14 @@ def generate_mask(image_path):
 
     # Save polygons to a file
     if polygons:
-        polygon_array = np.array(polygons, dtype=object)
-        np.save('polygon_coordinates.npy', polygon_array)
-        print(f'{len(polygons)} polygon coordinates saved to "polygon_coordinates.npy"')
-        mask = np.zeros_like(image[:,:,0], dtype=np.uint8)
-        for polygon in polygon_array:
-            cv2.fillPoly(mask, [polygon.astype(np.int32)], 1)
+        # Vertices of all polygons in one int32 array; polygon i is verts[offsets[i]:offsets[i+1]]
+        verts = np.concatenate(polygons).astype(np.int32)
+        offsets = np.cumsum([0] + [len(polygon) for polygon in polygons], dtype=np.int32)
+        np.savez('polygon_coordinates.npz', verts=verts, offsets=offsets)
+        print(f'{len(polygons)} polygon coordinates saved to "polygon_coordinates.npz"')
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for i in range(len(polygons)):
+            cv2.fillPoly(mask, [verts[offsets[i]:offsets[i+1]]], 1)
         return mask
     else:
         print("No polygons were drawn.")
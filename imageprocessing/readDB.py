@@ -11,6 +11,12 @@ import numpy as np
 import glob
 import os
 import sys
+from functools import cached_property
+
+# Parsed site sheets keyed by (absolute path, modification time, site name), so constructing
+# readDB again for the same site does not re-read the Excel file. Only the newest version of each
+# path/site is kept, and every instance gets its own copy so mutating one does not affect the others.
+_parse_cache = {}
 
 class readDB:
     
@@ -20,82 +26,99 @@ class readDB:
         self._parse_file(path)
     
     def _parse_file(self, path):
-        xl_db = pd.ExcelFile(self.path)
-        self.all_sites = xl_db.sheet_names
-        self.data = xl_db.parse(self.sitename)
+        abspath = os.path.abspath(path)
+        key = (abspath, os.path.getmtime(path), self.sitename)
+        if key not in _parse_cache:
+            # Drop sheets parsed from an older version of the file
+            for stale in [k for k in _parse_cache if k[0] == abspath and k[2] == self.sitename]:
+                del _parse_cache[stale]
+            # Only the site's sheet is parsed; the sheet list is read lazily by all_sites
+            _parse_cache[key] = pd.read_excel(path, sheet_name=self.sitename, engine='calamine')
+        self.data = _parse_cache[key].copy()
         self.data2 = self.data.set_index('Station Data')
+        # Station values live in the second column; read it into one array so accessors index it directly
+        self._values = self.data.iloc[:,1].to_numpy()
+    
+    @cached_property
+    def all_sites(self):
+        with pd.ExcelFile(self.path, engine='calamine') as xl_db:
+            return xl_db.sheet_names
     
-    @property
+    @cached_property
     def active(self):
         active = self.data.columns[1]
         return active
     
-    @property
+    @cached_property
     def x0(self):
-        x0 = self.data.iloc[0,1]
+        x0 = self._values[0]
         return x0
     
-    @property
+    @cached_property
     def y0(self):
-        y0 = self.data.iloc[1,1]
+        y0 = self._values[1]
         return y0
     
-    @property
+    @cached_property
     def z0(self):
-        z0 = self.data.iloc[2,1]
+        z0 = self._values[2]
         return z0
     
-    @property
+    @cached_property
     def azimuth(self):
-        azimuth = self.data.iloc[14,1]
+        azimuth = self._values[14]
         return azimuth
     
-    @property
+    @cached_property
     def tilt(self):
-        tilt = self.data.iloc[15,1]
+        tilt = self._values[15]
         return tilt
     
-    @property
+    @cached_property
     def roll(self):
-        roll = self.data.iloc[16,1]
+        roll = self._values[16]
         return roll
     
-    @property
+    @cached_property
     def xlim(self):
-        xlim = np.array([self.data.iloc[9,1],self.data.iloc[10,1]])
+        xlim = np.array([self._values[9],self._values[10]])
         return xlim
 
-    @property
+    @cached_property
     def ylim(self):
-        ylim = np.array([self.data.iloc[11,1],self.data.iloc[12,1]])
+        ylim = np.array([self._values[11],self._values[12]])
         return ylim
     
-    @property
+    @cached_property
     def dxdy(self):
-        dxdy = self.data.iloc[13,1]
+        dxdy = self._values[13]
         return dxdy
     
-    @property
+    @cached_property
     def beta0(self):
         beta0 = np.array([0,0,self.z0,self.azimuth,self.tilt,self.roll])
         return beta0
     
-    @property
+    @cached_property
     def x(self):
         x = np.arange(self.xlim[0],self.xlim[1]+self.dxdy,self.dxdy)
         return x
     
-    @property
+    @cached_property
     def y(self):
         y = np.arange(self.ylim[0],self.ylim[1]+self.dxdy,self.dxdy)
         return y
 
-    @property
+    @cached_property
+    def _grids(self):
+        # Xgrid and Ygrid come from the same meshgrid call
+        return np.meshgrid(self.x,self.y)
+
+    @cached_property
     def Xgrid(self):
-            Xgrid, Ygrid = np.meshgrid(self.x,self.y)
-            return Xgrid
+        return self._grids[0]
     
-    @property
+    @cached_property
     def gcp(self):
         GCP = [
             {
@@ -143,81 +166,84 @@ class readDB:
         ]
         return GCP
 
-    @property
+    @cached_property
     def xyz(self):
         GCP = self.gcp
-        xyz = np.array([[gcp["x"], gcp["y"], gcp["z"]] for gcp in GCP])
-        for i in range(7):
-            xyz[i][0] = xyz[i][0] - self.x0
-            xyz[i][1] = xyz[i][1] - self.y0
+        xyz = np.fromiter((gcp[k] for gcp in GCP for k in ("x", "y", "z")), dtype=float, count=3*len(GCP)).reshape(-1,3)
+        xyz[:,0] -= self.x0
+        xyz[:,1] -= self.y0
         return xyz
     
-    @property
+    @cached_property
     def Ygrid(self):
-            Xgrid, Ygrid = np.meshgrid(self.x,self.y)
-            return Ygrid
-    
-    @property
+        return self._grids[1]
+
+    @cached_property
+    def world_xyz_h(self):
+        # Homogeneous grid coordinates at z = 0 (4 x N, in Xgrid.ravel() order), shared by every rectification
+        world_xyz_h = np.ones((4, self.Xgrid.size))
+        world_xyz_h[0] = self.Xgrid.ravel()
+        world_xyz_h[1] = self.Ygrid.ravel()
+        world_xyz_h[2] = 0
+        return world_xyz_h
+    
+    @cached_property
     def iGCPs(self):
          # Locate 'GCP Name' in excel file
         iGCPs = self.data[self.data.iloc[:,0] == 'GCP name'].index
         return iGCPs
     
-    @property
+    @cached_property
     def nGCPs(self):
         # Define amount of GCPs specified in site excel sheet
         nGCPs = len(self.iGCPs)
         return nGCPs
     
-    @property
+    @cached_property
     def GCPsCombo(self):
         # Get user defined combination of GCPs to be used
         iGCPsCombo = [self.data[self.data.iloc[:,0] == 'GCP combo'].index.values]
-        GCPsCombo = self.data.iloc[iGCPsCombo[0][0],1]
+        GCPsCombo = self._values[iGCPsCombo[0][0]]
         GCPsCombo = np.array(GCPsCombo[1:-1].split()).astype(int)-1
         return GCPsCombo
     
-    @property
+    @cached_property
     def GCPsName(self):
         GCPsName = self.data.iloc[self.iGCPs,1]
         GCPsName = GCPsName.values.tolist()
         return GCPsName
     
-    @property
+    @cached_property
     def GCPmat(self):
-        # Initialize empty dataframe with column names
-        GCPmat = pd.DataFrame(columns=['easting', 'northing', 'x', 'y','z'])
+        # Row positions of the selected GCPs; easting, northing and z follow each 'GCP name' row
+        iGCP = np.asarray(self.iGCPs)[self.GCPsCombo]
+        easting = self._values[iGCP+1].astype(float)
+        northing = self._values[iGCP+2].astype(float)
+        z = self._values[iGCP+3].astype(float)
         
-        # Fill GCPmat with location data of GCPs
-        for i in range(len(self.GCPsCombo)):
-            iGCP = self.iGCPs[self.GCPsCombo[i]]
-            
-            GCPmat.loc[i,'easting'] = self.data.iloc[iGCP+1,1]
-            GCPmat.loc[i,'northing'] = self.data.iloc[iGCP+2,1]
-            GCPmat.loc[i,'z'] = self.data.iloc[iGCP+3,1]
-            GCPmat.loc[i,'x'] = GCPmat.loc[i,'easting']-self.x0
-            GCPmat.loc[i,'y'] = GCPmat.loc[i,'northing']-self.y0
+        GCPmat = pd.DataFrame({'easting': easting, 'northing': northing,
+                               'x': easting-self.x0, 'y': northing-self.y0, 'z': z})
             
         return GCPmat
     
-    @property
+    @cached_property
     def FOV(self):
         FOV = np.zeros(2)
-        FOV[0] = self.data.iloc[17,1]
-        FOV[1] = self.data.iloc[18,1]
+        FOV[0] = self._values[17]
+        FOV[1] = self._values[18]
         return FOV
     
-    @property
+    @cached_property
     def ObjectNames(self):
         ObjectNames = self.data2.loc['Object Names'].iloc[0]
         return str(ObjectNames).split(',')
     
-    @property
+    @cached_property
     def ObjectModels(self):
         ObjectModels = self.data2.loc['Models'].iloc[0]
         return str(ObjectModels).split(',')
     
-    @property
+    @cached_property
     def RefImage(self):
         RefImage = self.data2.loc['Reference Image'].iloc[0]
         return RefImage
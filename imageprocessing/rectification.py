@@ -9,141 +9,198 @@ Created by: Math van Soest: https://github.com/mathvansoest/CoastSnapPy/blob/mai
 """
 
 import numpy as np
-import numpy.matlib
-from scipy import interpolate
+import cv2
+import os
+from concurrent.futures import ThreadPoolExecutor
 from scipy.optimize import curve_fit
 
+def angles2R(a, t, s):
+    sa, ca = np.sin(a), np.cos(a)
+    st, ct = np.sin(t), np.cos(t)
+    ss, cs = np.sin(s), np.cos(s)
+    
+    R = np.empty((3, 3))
+    R[0,0] = ca*cs + sa*ct*ss
+    R[0,1] = -cs*sa + ss*ct*ca
+    R[0,2] = ss*st
+    R[1,0] = -ss*ca + cs*ct*sa
+    R[1,1] = ss*sa + cs*ct*ca
+    R[1,2] = cs*st
+    R[2,0] = st*sa
+    R[2,1] = st*ca
+    R[2,2] = -ct
+    
+    return R
+
+def cameraP(beta3, beta4, beta5, K, C):
+    # 3x4 camera matrix K R [I | -C], normalised so P[2,3] = 1
+    KR = K @ angles2R(beta3, beta4, beta5)
+    P = np.empty((3, 4))
+    P[:, :3] = KR
+    P[:, 3] = -(KR @ C)
+    return P/P[2,3]
+
+def findUV3DOF(xyz_h, beta3, beta4, beta5, K, C):
+    # xyz_h holds homogeneous GCP coordinates (4 x nGCP); K and C are fixed for the
+    # current focal length candidate and only the rotation changes between optimizer steps
+    P = cameraP(beta3, beta4, beta5, K, C)
+    UV = P @ xyz_h
+    UV = UV/UV[2:3,:]
+    UV = np.concatenate((UV[0,:], UV[1,:]))
+    return UV
+
+def findUV6DOF(xyz, beta0, beta1, beta2, beta3, beta4, beta5, K):
+    C = np.array([beta0, beta1, beta2])
+    xyz_h = np.ones((4, len(xyz)))
+    xyz_h[:3, :] = xyz.T
+    return findUV3DOF(xyz_h, beta3, beta4, beta5, K, C)
+
 class rectification():
     
-    def __init__(self,CSinput,registered,UV):
+    def __init__(self,CSinput,registered,UV,grid_search=False):
         self.UV = UV
         self.CSinput = CSinput
         self.registered = registered
         self.z = 0
-        
-        import numpy as np
-
-        def angles2R(a, t, s):
-            R = np.zeros((3, 3))
-            
-            R[0,0] = np.cos(a) * np.cos(s) + np.sin(a) * np.cos(t) * np.sin(s)
-            R[0,1] = -np.cos(s) * np.sin(a) + np.sin(s) * np.cos(t) * np.cos(a)
-            R[0,2] = np.sin(s) * np.sin(t)
-            R[1,0] = -np.sin(s) * np.cos(a) + np.cos(s) * np.cos(t) * np.sin(a)
-            R[1,1] = np.sin(s) * np.sin(a) + np.cos(s) * np.cos(t) * np.cos(a)
-            R[1,2] = np.cos(s) * np.sin(t)
-            R[2,0] = np.sin(t) * np.sin(a)
-            R[2,1] = np.sin(t) * np.cos(a)
-            R[2,2] = -np.cos(t)
-            
-            return R
-
-        def findUV3DOF(xyz, beta3, beta4, beta5):
-            K = np.array([[fx, 0, c0U],[0, -fy, c0V],[0, 0, 1]]).astype(float)
-            R = angles2R(beta3, beta4, beta5)
-            I = np.eye(3)
-            C = self.CSinput.beta0[0:3]
-            C.shape = (3,1)
-            IC = np.hstack((I,-C))
-            P = np.matmul(np.matmul(K,R),IC)
-            P = P/P[2,3]
-            UV = np.matmul(P,np.vstack((np.transpose(xyz), np.ones((1, len(xyz)), dtype = float))))
-            UV = UV/np.matlib.repmat(UV[2,:],3,1)
-            UV = np.transpose(np.concatenate((UV[0,:], UV[1,:])))
-            return UV 
-        
-        def findUV6DOF(xyz, beta0, beta1, beta2, beta3, beta4, beta5):
-            K = np.array([[fx, 0, c0U],[0, -fy, c0V],[0, 0, 1]]).astype(float)
-            R = angles2R(beta3, beta4, beta5)
-            I = np.eye(3)
-            C = np.array([beta0, beta1, beta2]).astype(float)
-            C.shape = (3,1)
-            IC = np.hstack((I,-C))
-            P = np.matmul(np.matmul(K,R),IC)
-            P = P/P[2,3]
-            UV = np.matmul(P,np.vstack((np.transpose(xyz), np.ones((1, len(xyz)), dtype = float))))
-            UV = UV/np.matlib.repmat(UV[2,:],3,1)
-            UV = np.transpose(np.concatenate((UV[0,:], UV[1,:])))
-            return UV
-        
-        def onScreen(U, V, Umax, Vmax):
-            Umin = 1
-            Vmin = 1
-            yesNo = np.zeros((len(U),1))
-            on = np.where((U>=Umin) & (U<=Umax) & (V>=Vmin) & (V<=Vmax)) [0]
-            yesNo[on] = 1
-            return yesNo
 
+        def fitUV3DOF(xyz_h, beta3, beta4, beta5):
+            return findUV3DOF(xyz_h, beta3, beta4, beta5, K, C)
+
+        def fitUV4DOF(xyz_h, f, beta3, beta4, beta5):
+            return findUV3DOF(xyz_h, beta3, beta4, beta5, np.array([[f, 0, c0U],[0, -f, c0V],[0, 0, 1]]), C)
 
         NV, NU = self.registered.shape[:2]
         c0U = NU/2
         c0V = NV/2
         im = self.registered
 
-        A = np.arange(5, 500005, 5)
-        B = np.arange(5, 500005, 5)
-        
         fx_max = 0.5*NU/np.tan(self.CSinput.FOV[0]*np.pi/360) #From Eq. 4 in Harley et al. (2019)
         fx_min = 0.5*NU/np.tan(self.CSinput.FOV[1]*np.pi/360) #From Eq. 4 in Harley et al. (2019)
         print(fx_min, fx_max)
-        fx_min = interpolate.interp1d(A, B, kind='nearest')(fx_min)
-        fx_max = interpolate.interp1d(A, B, kind='nearest')(fx_max)
+        # Snap to the 5 px focal length grid (nearest multiple of 5, ties rounding down)
+        fx_min = 5*np.ceil(fx_min/5 - 0.5)
+        fx_max = 5*np.ceil(fx_max/5 - 0.5)
         print(fx_min, fx_max)
         
-        fx_all = np.arange(fx_min, fx_max+5, 5)
-        fy_all = np.copy(fx_all)
-        xyz = CSinput.xyz
-
-        mse_all = np.zeros(len(fx_all))
+        xyz = np.asarray(CSinput.xyz, dtype=float)
+        xyz_h = np.vstack((np.transpose(xyz), np.ones((1, len(xyz)), dtype = float)))
+        beta0 = np.asarray(self.CSinput.beta0, dtype=float)
+        C = beta0[0:3]
         nGCP = len(self.CSinput.gcp)
         UV_true = np.concatenate(self.UV)
-        for i in range(len(fx_all)):
-        
-            fx = fx_all[i].astype(float)
-            fy = fy_all[i].astype(float)
-            beta3, Cov = curve_fit(findUV3DOF, xyz, UV_true, self.CSinput.beta0[3:6], maxfev=4000)
-            UV_pred = findUV3DOF(xyz, beta3[0], beta3[1], beta3[2])
-            mse_all[i] = np.mean((UV_true-UV_pred)**2)*((2*nGCP)/((2*nGCP)-len(beta3)))
-
-        fx = fx_all[np.argmin(mse_all)].astype(float)
-        fy = fy_all[np.argmin(mse_all)].astype(float)
-        beta3, Cov = curve_fit(findUV3DOF, xyz, UV_true, self.CSinput.beta0[3:6])
+
+        if grid_search:
+            fx_all = np.arange(fx_min, fx_max+5, 5)
+            fy_all = np.copy(fx_all)
+            mse_all = np.full(len(fx_all), np.inf)
+
+            # Coarse-to-fine focal length search: fit every 10th candidate first, then refine at the
+            # full 5 px resolution only around the three best coarse candidates
+            candidates = np.arange(0, len(fx_all), 10)
+            for stage in range(2):
+                for i in candidates:
+                    if np.isfinite(mse_all[i]):
+                        continue
+                    fx = fx_all[i].astype(float)
+                    fy = fy_all[i].astype(float)
+                    K = np.array([[fx, 0, c0U],[0, -fy, c0V],[0, 0, 1]], dtype=float)
+                    beta3, Cov = curve_fit(fitUV3DOF, xyz_h, UV_true, beta0[3:6], maxfev=4000)
+                    UV_pred = fitUV3DOF(xyz_h, beta3[0], beta3[1], beta3[2])
+                    mse_all[i] = np.mean((UV_true-UV_pred)**2)*((2*nGCP)/((2*nGCP)-len(beta3)))
+
+                best = np.argsort(mse_all)[:3]
+                candidates = np.unique(np.concatenate([np.arange(max(b-9, 0), min(b+10, len(fx_all))) for b in best]))
+
+            fx = fx_all[np.argmin(mse_all)].astype(float)
+            fy = fy_all[np.argmin(mse_all)].astype(float)
+        elif fx_max - fx_min < 5:
+            # The FOV range snaps to a single focal length, so only the angles are fitted below
+            fx = fy = fx_min
+        else:
+            # Fit the focal length jointly with the three angles, bounded to the FOV range
+            p0 = np.hstack([(fx_min+fx_max)/2, beta0[3:6]])
+            lower = [fx_min, -np.inf, -np.inf, -np.inf]
+            upper = [fx_max, np.inf, np.inf, np.inf]
+            beta4, Cov = curve_fit(fitUV4DOF, xyz_h, UV_true, p0, bounds=(lower, upper))
+            fx = fy = beta4[0]
+
+        K = np.array([[fx, 0, c0U],[0, -fy, c0V],[0, 0, 1]], dtype=float)
+        beta3, Cov = curve_fit(fitUV3DOF, xyz_h, UV_true, beta0[3:6])
         
-        self.beta6 = np.hstack([self.CSinput.beta0[0:3],beta3])
-        UV_pred = findUV6DOF(xyz, self.beta6[0], self.beta6[1], self.beta6[2], self.beta6[3], self.beta6[4], self.beta6[5])  
+        self.beta6 = np.hstack([C,beta3])
+        UV_pred = findUV6DOF(xyz, self.beta6[0], self.beta6[1], self.beta6[2], self.beta6[3], self.beta6[4], self.beta6[5], K)  
         
         self.UV_pred = np.reshape(UV_pred,[2,nGCP])
         UV_true = np.reshape(UV_true,[2,nGCP])
   
         leny, lenx = self.CSinput.Xgrid.shape
-        images_sumI = np.zeros([leny,lenx,3])
-        images_N = np.zeros(self.CSinput.Xgrid.shape)
         
-        xyz = np.column_stack((self.CSinput.Xgrid.T.flatten(), self.CSinput.Ygrid.T.flatten(), np.matlib.repmat(self.z, len(self.CSinput.Xgrid.T.flatten()), 1)))
-        UV = findUV6DOF(xyz, self.beta6[0], self.beta6[1], self.beta6[2], self.beta6[3], self.beta6[4], self.beta6[5])
-        UV = np.around(UV.astype('float'))
-        UV = np.reshape(UV, (-1, 2), order='F')
-        good = np.where(onScreen(UV[:,0], UV[:,1], NU, NV) == 1)[0]
-        UV = UV.astype(int)
-        arr = np.array([UV[good,1], UV[good,0]])
-        ind = np.ravel_multi_index(arr, (NV, NU), mode='clip', order='F')
-        foo = images_sumI
-        
-        for i in range(3):
-            I3 = im[:,:,i]
-            I3 = np.reshape(I3, (-1, 1), order='F')
-            I2 = I3[ind]
-            bar = foo[:,:,i]
-            bar = np.reshape(bar, (-1, 1), order='F')
-            bar[good] = I2
-            bar = np.reshape(bar, (len(images_sumI), -1), order='F')
-            foo[:,:,i] = bar
-
-        images_sumI  = foo
-
-        images_N = np.reshape(images_N, (-1, 1), order='F')
-        images_N[good] = 1
-        images_N = np.reshape(images_N, (self.CSinput.Xgrid.shape[0], self.CSinput.Xgrid.shape[1], 1), order='F')
-        N = np.tile(images_N, (1, 1, 3))
-        N[N==0]=np.nan
-        self.im = (images_sumI/N).astype(np.uint8)
\ No newline at end of file
+        # The camera is fixed once beta6 is solved, so project the whole grid with one 3x4 matrix
+        self.P = cameraP(self.beta6[3], self.beta6[4], self.beta6[5], K, self.beta6[0:3])
+        xyz_h = self.CSinput.world_xyz_h
+        if self.z != 0:
+            xyz_h = xyz_h.copy()
+            xyz_h[2] = self.z
+        UV = self.P @ xyz_h
+        UV = np.around(UV[:2]/UV[2], out=UV[:2])
+
+        # Build per-pixel lookup maps on the plan view grid and let cv2.remap gather the pixels.
+        # Nearest-neighbour on the rounded, clipped indices keeps the previous sampling exactly;
+        # off-screen grid cells point outside the image and come out black.
+        U = np.reshape(UV[0], (leny, lenx))
+        V = np.reshape(UV[1], (leny, lenx))
+        on = (U>=1) & (U<=NU) & (V>=1) & (V<=NV)
+        self.map_x = np.clip(U, 0, NU-1).astype(np.float32)
+        self.map_y = np.clip(V, 0, NV-1).astype(np.float32)
+        self.map_x[~on] = -1
+        self.map_y[~on] = -1
+        self.im = self.rectify(im)
+
+    def rectify(self, image):
+        """
+        Rectifies an image into the plan view using the camera solved for in __init__.
+
+        Registered images share the control image geometry, so the lookup maps can be reused for
+        every image in a batch without refitting the camera or reprojecting the grid.
+
+        Args:
+            image (ndarray): A registered image with the same shape as the one used to solve the camera.
+
+        Returns:
+            ndarray: The plan view image on the CSinput Xgrid/Ygrid.
+        """
+        return cv2.remap(image, self.map_x, self.map_y, interpolation=cv2.INTER_NEAREST,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    def generate_rectifications(self, folder_path='Registered', output_path='Rectified'):
+        """
+        Rectifies every registered JPG/JPEG image in folder_path and saves the plan views to output_path.
+
+        Reading, remapping and writing run in a thread pool; OpenCV releases the GIL for all three, so
+        images are processed in parallel while sharing the lookup maps without copying them.
+
+        Args:
+            folder_path (str): Directory containing the registered images. Defaults to 'Registered'.
+            output_path (str): Directory the rectified images are written to, under the same filenames.
+                Defaults to 'Rectified'.
+
+        Raises:
+            IOError: If a registered image cannot be read or a rectified image cannot be written.
+        """
+        os.makedirs(output_path, exist_ok=True)
+
+        with os.scandir(folder_path) as entries:
+            file_list = [entry.name for entry in entries if entry.name.lower().endswith(('.jpg', '.jpeg'))]
+
+        def rectify_file(file_name):
+            image_path = os.path.join(folder_path, file_name)
+            image = cv2.imread(image_path)
+            if image is None:
+                raise IOError(f"Could not read {image_path}")
+            # cv2.imwrite reports failure by returning False rather than raising
+            output_file = os.path.join(output_path, file_name)
+            if not cv2.imwrite(output_file, self.rectify(image)):
+                raise IOError(f"Could not write {output_file}")
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(rectify_file, file_list))
@@ -1,9 +1,50 @@
 import numpy as np
 from lightglue import LightGlue, SuperPoint, DISK, viz2d
-from lightglue.utils import load_image, rbd
+from lightglue.utils import numpy_image_to_torch
+from kornia.geometry.transform import warp_perspective
 import torch
 import cv2
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# SuperPoint's extract() resizes the long image side to this before detection
+_EXTRACT_SIZE = 1024
+
+def _image_to_tensor(image_cv):
+    """
+    Converts a BGR image to the RGB [0, 1] tensor SuperPoint expects, downscaled on the CPU first.
+
+    extract() resizes every input to _EXTRACT_SIZE on its long side anyway, so shrinking before the
+    conversion avoids building, uploading and resampling a full resolution float tensor.
+
+    Args:
+        image_cv (ndarray): The image loaded using OpenCV.
+
+    Returns:
+        Tensor: A (3, h, w) float tensor with the long side at most _EXTRACT_SIZE.
+    """
+    h, w = image_cv.shape[:2]
+    scale = _EXTRACT_SIZE / max(h, w)
+    if scale < 1:
+        size = (_EXTRACT_SIZE, round(h * scale)) if w >= h else (round(w * scale), _EXTRACT_SIZE)
+        image_cv = cv2.resize(image_cv, size, interpolation=cv2.INTER_AREA)
+    return numpy_image_to_torch(image_cv[..., ::-1])
+
+def _to_image_coordinates(kpts, image_cv, image):
+    """
+    Maps keypoints extracted from a downscaled tensor back to pixel coordinates of the full image.
+
+    Args:
+        kpts (Tensor): An (N, 2) tensor of (x, y) keypoints in the tensor's coordinates.
+        image_cv (ndarray): The full resolution image.
+        image (Tensor): The (3, h, w) tensor the keypoints were extracted from.
+
+    Returns:
+        Tensor: The keypoints in full resolution pixel coordinates.
+    """
+    scale = kpts.new_tensor([image_cv.shape[1] / image.shape[-1], image_cv.shape[0] / image.shape[-2]])
+    return (kpts + 0.5) * scale - 0.5
 
 class Registration():
     """
@@ -17,98 +58,241 @@ class Registration():
         matcher (nn.Module): LightGlue feature matcher.
         image0 (Tensor): The control image as a tensor.
         control_cv (ndarray): The control image loaded using OpenCV for transformation calculations.
+        control_size (tuple): (width, height) of the control image, the output size of every registration.
         control_feats (dict): Extracted features from the control image.
+        control_kpts (Tensor): Keypoints of the control image without the batch dimension.
         mask (ndarray): A binary mask used to filter keypoints in the control image.
+        mask_tensor (Tensor): The mask on the same device as the features.
+        copy_stream (torch.cuda.Stream or None): Stream used for host-to-device image uploads on CUDA.
+        cuda_warp (bool): Whether images are warped with OpenCV's CUDA module.
+        kornia_warp (bool): Whether images are warped on the GPU with Kornia when OpenCV has no CUDA module.
+            Otherwise they are warped with OpenCV on the CPU.
 
     Example:
         reg = Registration('raw/image.jpg', mask_array)
         reg.generate_registrations()  # Registers all images and saves the results.
+        reg = Registration('raw/image.jpg', mask_array, compile_matcher=True)  # torch.compile LightGlue for large batches.
+        reg = Registration('raw/image.jpg', mask_array, kornia_warp=True)  # Warp on the GPU without OpenCV CUDA.
     """
-    def __init__(self,control_filename, mask):
+    def __init__(self,control_filename, mask, compile_matcher=False, kornia_warp=False):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.extractor = SuperPoint(max_num_keypoints=2048).eval().to(self.device)
-        self.matcher = LightGlue(features="superpoint").eval().to(self.device)
+        if self.device.type == "cuda":
+            # TF32 tensor cores for the float32 convolutions and attention matmuls (Ampere and newer)
+            torch.set_float32_matmul_precision('high')
+            torch.backends.cudnn.allow_tf32 = True
+        max_num_keypoints = 2048
+        self.extractor = SuperPoint(max_num_keypoints=max_num_keypoints).eval().to(self.device)
+        # LightGlue runs its own attention under fp16 autocast when mp is set. Early stopping and point pruning
+        # keep their defaults; LightGlue already skips pruning for short keypoint sets per device.
+        self.matcher = LightGlue(features="superpoint", mp=self.device.type == "cuda").eval().to(self.device)
+        if compile_matcher:
+            # LightGlue pads keypoints to a few static lengths so the compiled layers are not recaptured per image.
+            # Only pairs that fit the largest length take the compiled path, and LightGlue's default lengths stop
+            # short of the extractor's cap, so extend them to cover it.
+            # The one-off compile cost only pays off on larger batches, so this is opt-in.
+            self.matcher.compile(mode="reduce-overhead", static_lengths=[512, 1024, 1536, max_num_keypoints])
         
-        self.image0 = load_image(control_filename)
         self.control_cv = cv2.imread(control_filename)
-        self.control_feats = self.extractor.extract(self.image0.to(self.device))
+        self.image0 = _image_to_tensor(self.control_cv)
+        h_control, w_control = self.control_cv.shape[:2]
+        self.control_size = (w_control, h_control)
+        with torch.inference_mode(), torch.autocast(device_type=self.device.type, dtype=torch.float16,
+                                                     enabled=self.device.type == "cuda"):
+            self.control_feats = self.extractor.extract(self.image0.to(self.device))
         self.mask = mask
+
+        # The control features never change, so strip the batch dimension and move the mask to the device once
+        self.control_kpts = _to_image_coordinates(self.control_feats["keypoints"][0], self.control_cv, self.image0)
+        self.mask_tensor = torch.from_numpy(np.ascontiguousarray(mask)).to(self.device)
+
+        # Side stream for uploading images from the reader threads
+        self.copy_stream = torch.cuda.Stream() if self.device.type == "cuda" else None
+
+        # Warp on the GPU when OpenCV was built with CUDA; stock pip wheels report no devices
+        self.cuda_warp = cv2.cuda.getCudaEnabledDeviceCount() > 0
+        # Kornia's bilinear sampling is not checked against cv2.warpPerspective yet, so it is opt-in
+        self.kornia_warp = kornia_warp and self.device.type == "cuda"
     
-    def point_in_mask(self, mask, coordinate):
+    @staticmethod
+    def point_in_mask(mask, coordinates):
         """
-        Determines if a given point (coordinate) falls within the masked region (non-zero) of an image.
+        Determines which points (coordinates) fall within the masked region (non-zero) of an image.
 
         Args:
             mask (ndarray): A binary mask array.
-            coordinate (tuple): A tuple (x, y) specifying the point to check within the mask.
+            coordinates (ndarray or tuple): An (N, 2) array of (x, y) points, or a single (x, y) tuple.
+                Points are rounded to the nearest pixel and clipped to the mask bounds.
 
         Returns:
-            bool: True if the point is within a masked region, False otherwise.
+            ndarray or bool: A boolean array that is True where a point is within a masked region,
+            or a single bool when one point is given.
         """
-        x, y = coordinate
-        x, y = int(round(x)), int(round(y))
+        xy = np.rint(np.asarray(coordinates)).astype(np.int64)
+        x = np.clip(xy[..., 0], 0, mask.shape[1] - 1)
+        y = np.clip(xy[..., 1], 0, mask.shape[0] - 1)
         return mask[y, x] != 0
 
-    def image_registration(self, image_path, feats0, index):
+    def _read_image(self, image_path):
         """
-        Registers an image to the control image using extracted features and homography, then saves the output.
+        Reads an image both as a tensor for feature extraction and with OpenCV for warping.
+
+        The JPEG is decoded once with OpenCV and the tensor is built from that array (RGB, scaled to [0, 1]),
+        downscaled to the size SuperPoint extracts at.
 
         Args:
-            image_path (str): Path to the target image for registration.
-            feats0 (dict): Pre-extracted features from the control image.
-            index (int): An index number for naming the saved registered image.
+            image_path (str): Path to the image.
 
         Returns:
-            ndarray: The registered image as an ndarray.
+            tuple: The image as a (3, h, w) tensor and as a full resolution BGR ndarray. On CUDA the tensor is already on
+            the device, uploaded from pinned memory on a side stream so the copy overlaps extraction of the
+            previous image.
         """
-        image1 = load_image(image_path)
         image_cv = cv2.imread(image_path)
-        feats1 = self.extractor.extract(image1.to(self.device))
+        image = _image_to_tensor(image_cv)
+        if self.copy_stream is not None:
+            with torch.cuda.stream(self.copy_stream):
+                image = image.pin_memory().to(self.device, non_blocking=True)
+                copied = torch.cuda.Event()
+                copied.record(self.copy_stream)
+            # Only this reader thread waits for the upload
+            copied.synchronize()
+        return image, image_cv
+
+    @staticmethod
+    def _write_image(path, image):
+        """
+        Saves an image with OpenCV, raising if it could not be written.
+
+        Args:
+            path (str): Output path; the extension selects the encoder.
+            image (ndarray): The image to save.
+
+        Raises:
+            IOError: If cv2.imwrite reports failure (it returns False rather than raising).
+        """
+        if not cv2.imwrite(path, image):
+            raise IOError(f"Could not write {path}")
 
-        matches01 = self.matcher({"image0": feats0, "image1": feats1})
-        feats0, feats1, matches01 = [
-            rbd(x) for x in [feats0, feats1, matches01]
-        ]
-        kpts0, kpts1, matches = feats0["keypoints"], feats1["keypoints"], matches01["matches"]
+    def _register(self, image1, image_cv, feats0):
+        """
+        Matches an image against the control features and warps it onto the control image.
+
+        Args:
+            image1 (Tensor): The target image as a (possibly downscaled) tensor.
+            image_cv (ndarray): The target image loaded using OpenCV.
+            feats0 (dict): Pre-extracted features from the control image.
+
+        Returns:
+            ndarray: The registered image as an ndarray.
+        """
+        if image1.is_cuda:
+            # Uploaded on the copy stream; keep the allocator from reusing it while the default stream reads it
+            image1.record_stream(torch.cuda.current_stream())
+        with torch.inference_mode():
+            with torch.autocast(device_type=self.device.type, dtype=torch.float16, enabled=self.device.type == "cuda"):
+                feats1 = self.extractor.extract(image1.to(self.device))
+            matches01 = self.matcher({"image0": feats0, "image1": feats1})
+        # Index the single batch entry directly instead of unbatching every tensor in the dicts with rbd
+        kpts0 = self.control_kpts if feats0 is self.control_feats else feats0["keypoints"][0]
+        kpts1 = _to_image_coordinates(feats1["keypoints"][0], image_cv, image1)
+        matches = matches01["matches"][0]
         m_kpts0, m_kpts1 = kpts0[matches[..., 0]], kpts1[matches[..., 1]]
 
-        m_kpts0_list = list(map(tuple, m_kpts0.tolist()))
-        m_kpts1_list = list(map(tuple, m_kpts1.tolist()))
+        # Keep only matches whose control keypoint lies inside the mask; the lookup runs on the device so
+        # only the kept matches are copied back (same rounding and clipping as point_in_mask)
+        xy = m_kpts0.round().long()
+        x = xy[:, 0].clamp_(0, self.mask_tensor.shape[1] - 1)
+        y = xy[:, 1].clamp_(0, self.mask_tensor.shape[0] - 1)
+        in_mask = self.mask_tensor[y, x] != 0
+        kps0 = m_kpts0[in_mask].float().cpu().numpy()
+        kps1 = m_kpts1[in_mask].float().cpu().numpy()
 
-        kps0, kps1 = [], []
+        H, _ = cv2.findHomography(kps1, kps0, cv2.USAC_MAGSAC, 3.0, maxIters=2000, confidence=0.999)
+        if self.cuda_warp:
+            g_src = cv2.cuda_GpuMat()
+            g_src.upload(image_cv)
+            return cv2.cuda.warpPerspective(g_src, H, self.control_size).download()
+        if self.kornia_warp:
+            # Stock OpenCV wheels have no CUDA module, so sample on the GPU with Kornia; the image is
+            # uploaded as uint8 and only the warped result comes back
+            src = torch.from_numpy(image_cv).to(self.device).permute(2, 0, 1)[None].float()
+            H_t = torch.from_numpy(H).to(self.device, torch.float32)[None]
+            w_control, h_control = self.control_size
+            warped = warp_perspective(src, H_t, (h_control, w_control), align_corners=True)
+            return warped[0].permute(1, 2, 0).round_().clamp_(0, 255).to(torch.uint8).cpu().numpy()
+        return cv2.warpPerspective(image_cv, H, self.control_size)
 
-        for i in range(len(m_kpts0_list)):
-            if self.point_in_mask(self.mask, m_kpts0_list[i]):
-                kps0.append(m_kpts0_list[i])
-                kps1.append(m_kpts1_list[i])
+    def image_registration(self, image_path, feats0, index):
+        """
+        Registers an image to the control image using extracted features and homography, then saves the output.
 
-        kps0 = np.array(kps0, dtype=np.float32)
-        kps1 = np.array(kps1, dtype=np.float32)
+        Args:
+            image_path (str): Path to the target image for registration.
+            feats0 (dict): Pre-extracted features from the control image.
+            index (int): An index number for naming the saved registered image.
 
-        H, _ = cv2.findHomography(kps1, kps0, cv2.RANSAC)
-        h_control, w_control = self.control_cv.shape[:2]
-        img_new_registered = cv2.warpPerspective(image_cv, H, (w_control, h_control))
+        Returns:
+            ndarray: The registered image as an ndarray.
+        """
+        image1, image_cv = self._read_image(image_path)
+        img_new_registered = self._register(image1, image_cv, feats0)
         
         # Save registered images
-        cv2.imwrite(f"Registered/registration{index}.jpeg", img_new_registered)
+        self._write_image(f"Registered/registration{index}.jpeg", img_new_registered)
         
         return img_new_registered
 
-    def generate_registrations(self):
+    def generate_registrations(self, prefetch=4):
         """
         Generates registrations for all JPG files in the 'raw' directory.
+
+        Images are taken in filename order and saved as 'Registered/registration{i}.jpeg' with i counting
+        from 1, so the numbering no longer depends on the order the filesystem lists the directory in.
+
+        Decoding and encoding run in background threads (OpenCV releases the GIL for both), so the next
+        images are read while the current one is matched and warped, and results are written out while
+        the following ones are processed.
+
+        Args:
+            prefetch (int, optional): Number of images decoded ahead of the one being registered, and the
+                number of registered images that may wait to be written. Defaults to 4.
+
+        Raises:
+            IOError: If a registered image could not be written.
         """
         folder_path = 'Registered'
         os.makedirs(folder_path, exist_ok=True)
 
         folder_path = 'raw'
-        file_list = os.listdir(folder_path)
+        with os.scandir(folder_path) as entries:
+            image_paths = sorted(entry.path for entry in entries if entry.name.lower().endswith('.jpg'))
+
+        # Registrations are numbered 1..N over the JPGs in filename order
+        jobs = iter(enumerate(image_paths, 1))
+
+        with ThreadPoolExecutor(max_workers=prefetch) as reader, ThreadPoolExecutor(max_workers=2) as writer:
+            pending = deque()
+            writes = deque()
+
+            def submit_next():
+                for i, image_path in jobs:
+                    pending.append((i, reader.submit(self._read_image, image_path)))
+                    return
+
+            for _ in range(prefetch):
+                submit_next()
 
-        i = 0
+            while pending:
+                i, future = pending.popleft()
+                submit_next()
+                image1, image_cv = future.result()
+                registered_image = self._register(image1, image_cv, self.control_feats)
+                # Bound the queued writes like the reads, so warped frames do not pile up in memory
+                # when encoding falls behind
+                if len(writes) >= prefetch:
+                    writes.popleft().result()
+                writes.append(writer.submit(self._write_image, f"Registered/registration{i}.jpeg", registered_image))
 
-        for file_name in file_list:
-            i += 1
-            if file_name.lower().endswith('.jpg'):
-                image_path = os.path.join(folder_path, file_name)
-                self.image_registration(image_path, self.control_feats, i)
-                # registered_image = self.image_registration(image_path, self.control_feats, i)
+            # Wait for the remaining writes; result() re-raises any write error
+            while writes:
+                writes.popleft().result()
@@ -1,16 +1,4 @@
-from setuptools import setup, find_packages
+from setuptools import setup
 
-def load_requirements(filename='requirements.txt'):
-    with open(filename, 'r') as file:
-        return file.read().splitlines()
-
-# Load requirements from the file
-requirements = load_requirements()
-
-setup(
-    name="CSImageProcessing",
-    version="1.0.0",
-    description="Image registration and rectification on Coastsnap images",
-    packages=find_packages(),
-    install_requires=requirements
-)
\ No newline at end of file
+# Metadata and pinned dependencies live in pyproject.toml
+setup()